@@ -359,7 +359,14 @@ def _S_invsqrt(X, ddof=0, min_sval=1e-10, if_singular='raise'):
     S_ : np.ndarray (n_features, n_features)
         square-root of inverse covariance matrix
     """
-    U, s, Vh = np.linalg.svd(X, full_matrices=False)
+    if X.shape[0] > X.shape[1]:
+        # X = QR with R (n_features, n_features) has the same singular values
+        # and right singular vectors as X, but is much cheaper to decompose
+        # for tall data matrices as the left singular vectors aren't formed
+        X_ = np.linalg.qr(X, mode='r')
+    else:
+        X_ = X
+    s, Vh = np.linalg.svd(X_, full_matrices=False)[1:]
     V = Vh.T
 
     sinv = np.where(s > min_sval, 1 / s, 0)
@@ -1,5 +1,9 @@
+import functools
+import itertools
+
 import numpy as np
-from scipy.spatial.distance import cosine as cosdist
+import pytest
+from scipy.linalg import qr, solve, svdvals
 
 from numpy.testing import assert_raises, assert_allclose, assert_equal, assert_warns, assert_array_almost_equal
 
@@ -18,24 +22,35 @@ from gemmr.generative_model import _check_subspace_dimension, _mk_Sigmaxy, \
 from gemmr.estimators import SVDCCA, SVDPLS
 
 
+# read-only identity matrix shared by the low-level tests, slice
+# ``_EYE[:n, :n]`` for an n x n identity
+_EYE = np.eye(8)
+_EYE.setflags(write=False)
+
+
+def _is_unit_norm(A):
+    """Whether all columns of ``A`` have unit norm (squared norms suffice)."""
+    return np.allclose(np.einsum('ij,ij->j', A, A), 1)
+
+
 def _align(x, y):
-    for i in range(x.shape[1]):
-        if np.dot(x[:, i], y[:, i]) < 0:
-            x[:, i] *= -1
+    signs = np.sign(np.einsum('ij,ij->j', x, y))
+    signs[signs == 0] = 1
+    x *= signs
     return x
 
 
 def _test_jcov(model, estr, rs, decimal):
+    if model == 'cca':
+        JointCovarianceModel = JointCovarianceModelCCA
+    elif model == 'pls':
+        JointCovarianceModel = JointCovarianceModelPLS
+    else:
+        raise ValueError(f'Invalid model: {model}')
     for px, py in [(2, 4), (16, 8), (32, 32)]:
         for r_between in rs:
             for ax, ay in [(0, 0), (-.5, -1.), (-.25, -.75)]:
                 gemmr = GEMMR(model=model, px=px, py=py, r_between=r_between, ax=ax, ay=ay)
-                if model == 'cca':
-                    JointCovarianceModel = JointCovarianceModelCCA
-                elif model == 'pls':
-                    JointCovarianceModel = JointCovarianceModelPLS
-                else:
-                    raise ValueError(f'Invalid model: {model}')
                 jcov = JointCovarianceModel.from_jcov_model(gemmr, random_state=0)
 
                 assert_allclose(gemmr.true_corrs_, jcov.true_corrs_, atol=0.01, rtol=1e-6)
@@ -71,27 +86,21 @@ def test_GEMMR():
     r_between = 0.3
     Sigma = GEMMR('cca', px=2, py=2, ax=0, ay=0, r_between=r_between, m=1).Sigma_
     SigmaXY = Sigma[:2, 2:]
-    r_hat = np.linalg.svd(SigmaXY, full_matrices=False, compute_uv=False)
+    r_hat = svdvals(SigmaXY, check_finite=False)
     assert_array_almost_equal(r_hat, [r_between, 0])
 
 
 def test_generative_model_class():
+    required = {
+        'm', 'px', 'py', 'ax', 'ay', 'random_state', 'Sigma_', 'true_assocs_',
+        'true_corrs_', 'U_latent_', 'V_latent_', 'latent_expl_var_ratios_x_',
+        'latent_expl_var_ratios_y_', 'latent_mode_vector_algo_',
+        'generate_data',
+    }
+
     def _test_gm(gm):
-        assert hasattr(gm, 'm')
-        assert hasattr(gm, 'px')
-        assert hasattr(gm, 'py')
-        assert hasattr(gm, 'ax')
-        assert hasattr(gm, 'ay')
-        assert hasattr(gm, 'random_state')
-        assert hasattr(gm, 'Sigma_')
-        assert hasattr(gm, 'true_assocs_')
-        assert hasattr(gm, 'true_corrs_')
-        assert hasattr(gm, 'U_latent_')
-        assert hasattr(gm, 'V_latent_')
-        assert hasattr(gm, 'latent_expl_var_ratios_x_')
-        assert hasattr(gm, 'latent_expl_var_ratios_y_')
-        assert hasattr(gm, 'latent_mode_vector_algo_')
-        assert hasattr(gm, 'generate_data')
+        missing = required - set(dir(gm))
+        assert not missing, missing
 
     gemmr = GEMMR('cca')
     _test_gm(gemmr)
@@ -99,6 +108,13 @@ def test_generative_model_class():
     _test_gm(JointCovarianceModelPLS.from_jcov_model(gemmr))
 
 
+def _cosdist(a, b):
+    """Cosine distance between 1-dim arrays ``a`` and ``b``, like
+    ``scipy.spatial.distance.cosine`` but without its input validation.
+    """
+    return 1 - a.dot(b) / (np.linalg.norm(a) * np.linalg.norm(b))
+
+
 def _test_jcov_from_other_jcov(gemmr, estr, Jcov, n_per_ftr=512):
     n = (gemmr.px + gemmr.py) * n_per_ftr
     X, Y = gemmr.generate_data(n)
@@ -107,8 +123,8 @@ def _test_jcov_from_other_jcov(gemmr, estr, Jcov, n_per_ftr=512):
     jcov = Jcov.from_jcov_model(gemmr)
 
     dissim = 1 - min(
-        np.abs(1 - cosdist(estr.x_rotations_[:, 0], jcov.U_latent_[:, 0])),
-        np.abs(1 - cosdist(estr.y_rotations_[:, 0], jcov.V_latent_[:, 0])),
+        np.abs(1 - _cosdist(estr.x_rotations_[:, 0], jcov.U_latent_[:, 0])),
+        np.abs(1 - _cosdist(estr.y_rotations_[:, 0], jcov.V_latent_[:, 0])),
     )
     assert dissim < 0.03
 
@@ -125,8 +141,8 @@ def _test_jcov_from_same_jcov(gemmr, Jcov):
     assert np.allclose(gemmr.Sigma_, jcov.Sigma_)
 
     dissim = 1 - min(
-        np.abs(1 - cosdist(gemmr.U_latent_[:, 0], jcov.U_latent_[:, 0])),
-        np.abs(1 - cosdist(gemmr.V_latent_[:, 0], jcov.V_latent_[:, 0])),
+        np.abs(1 - _cosdist(gemmr.U_latent_[:, 0], jcov.U_latent_[:, 0])),
+        np.abs(1 - _cosdist(gemmr.V_latent_[:, 0], jcov.V_latent_[:, 0])),
     )
     assert dissim < 0.001
 
@@ -139,27 +155,22 @@ def _test_jcov_from_same_jcov(gemmr, Jcov):
                        jcov.latent_expl_var_ratios_y_)
 
 
-def test_jcov_from_jcov():
-    cca = SVDCCA()
-    pls = SVDPLS()
-    for px in [2, 4, 8, 16, 32]:
-        for py in [px, px + 4]:
-            for ax in [-1.5, -1, -.5]:
-                for ay in [-1.5, -1, -.5]:
-                    for r in [.3, .5]:
-                        gemmr = GEMMR('cca', px=px, py=py, ax=ax, ay=ay,
-                                      r_between=r)
-                        _test_jcov_from_same_jcov(gemmr,
-                                                  JointCovarianceModelCCA)
-                        _test_jcov_from_other_jcov(gemmr, pls,
-                                                   JointCovarianceModelPLS)
-
-                        gemmr = GEMMR('pls', px=px, py=py, ax=ax, ay=ay,
-                                      r_between=r)
-                        _test_jcov_from_same_jcov(gemmr,
-                                                  JointCovarianceModelPLS)
-                        _test_jcov_from_other_jcov(gemmr, cca,
-                                                   JointCovarianceModelCCA)
+@pytest.mark.parametrize('px,py,ax,ay,r', [
+    pytest.param(px, py, ax, ay, r,
+                 id=f'px{px}-py{py}-ax{ax}-ay{ay}-r{r}')
+    for px in [2, 4, 8, 16, 32]
+    for py in [px, px + 4]
+    for ax, ay, r in itertools.product([-1.5, -1, -.5], [-1.5, -1, -.5],
+                                       [.3, .5])
+])
+def test_jcov_from_jcov(px, py, ax, ay, r):
+    gemmr = GEMMR('cca', px=px, py=py, ax=ax, ay=ay, r_between=r)
+    _test_jcov_from_same_jcov(gemmr, JointCovarianceModelCCA)
+    _test_jcov_from_other_jcov(gemmr, SVDPLS(), JointCovarianceModelPLS)
+
+    gemmr = GEMMR('pls', px=px, py=py, ax=ax, ay=ay, r_between=r)
+    _test_jcov_from_same_jcov(gemmr, JointCovarianceModelPLS)
+    _test_jcov_from_other_jcov(gemmr, SVDCCA(), JointCovarianceModelCCA)
 
 def test_setup_model():
     assert_raises(ValueError, setup_model, 'cca', max_n_sigma_trials=0)
@@ -184,7 +195,7 @@ def test_setup_model():
     r_between = 0.3
     Sigma = setup_model('cca', px=2, py=2, ax=0, ay=0, r_between=r_between, m=1, return_full=False)
     SigmaXY = Sigma[:2, 2:]
-    r_hat = np.linalg.svd(SigmaXY, full_matrices=False, compute_uv=False)
+    r_hat = svdvals(SigmaXY, check_finite=False)
     assert_array_almost_equal(r_hat, [r_between, 0])
 
 
@@ -212,21 +223,28 @@ def test__mk_Sigmaxy():
     pass  # Nothing to test?
 
 
-mocked__add_lowvariance_subspace_components = create_autospec(
-    gemmr.generative_model._add_lowvariance_subspace_components,
-    return_value=(np.eye(4)[:, [0]], np.eye(5)[:, [0]])
-)
+@functools.lru_cache(maxsize=None)
+def _mocked__add_lowvariance_subspace_components():
+    # created lazily, as signature introspection is costly at import time;
+    # the spec is the function imported above because the attribute in
+    # gemmr.generative_model is already patched when this is first called
+    return create_autospec(
+        _add_lowvariance_subspace_components,
+        return_value=(_EYE[:4, [0]], _EYE[:5, [0]])
+    )
 
 
-@patch('gemmr.generative_model._add_lowvariance_subspace_components', side_effect=mocked__add_lowvariance_subspace_components)
+@patch('gemmr.generative_model._add_lowvariance_subspace_components')
 def test__find_latent_mode_vectors_pc1(mock__add_lowvariance_subspace_components):
+    mock__add_lowvariance_subspace_components.side_effect = \
+        _mocked__add_lowvariance_subspace_components()
     px, py = 4, 5
     qx, qy = 4, 3
     m = 1
-    Sigmaxx = np.eye(px)
-    Sigmayy = np.eye(py)
-    U = np.eye(px)
-    V = np.eye(py)
+    Sigmaxx = _EYE[:px, :px]
+    Sigmayy = _EYE[:py, :py]
+    U = _EYE[:px, :px]
+    V = _EYE[:py, :py]
     assemble_Sigmaxy = _assemble_Sigmaxy_pls
     expl_var_ratio_thr = 1./2
     max_n_sigma_trials = 1
@@ -249,10 +267,10 @@ def test__find_latent_mode_vectors_opti():
     px, py = 4, 5
     qx, qy = 4, 3
     m = 1
-    Sigmaxx = np.eye(px)
-    Sigmayy = np.eye(py)
-    U = np.eye(px)
-    V = np.eye(py)
+    Sigmaxx = _EYE[:px, :px]
+    Sigmayy = _EYE[:py, :py]
+    U = _EYE[:px, :px]
+    V = _EYE[:py, :py]
     assemble_Sigmaxy = _assemble_Sigmaxy_pls
     expl_var_ratio_thr = 1. / 2
     max_n_sigma_trials = 1
@@ -281,8 +299,9 @@ def test__generate_random_dominant_subspace_rotations():
     px, py = 4, 5
     qx, qy = 4, 3
     m = 2
-    U = np.eye(px)
-    V = np.eye(py)
+    # only shapes are checked, so single precision suffices
+    U = np.eye(px, dtype=np.float32)
+    V = np.eye(py, dtype=np.float32)
     rng = check_random_state(0)
     uvrots = None
     U_dominant, V_dominant = _generate_random_dominant_subspace_rotations(U, V, m, qx, qy, rng, uvrots)
@@ -294,8 +313,8 @@ def test__generate_dominant_subspace_rotations_from_opti():
     px, py = 4, 5
     qx, qy = 4, 3
     m = 2
-    U = np.eye(px)
-    V = np.eye(py)
+    U = _EYE[:px, :px]
+    V = _EYE[:py, :py]
     rng = check_random_state(0)
     uvrots = [(None, np.arange(qx), np.arange(qy))]
     U_dominant, V_dominant = _generate_dominant_subspace_rotations_from_opti(U, V, m, qx, qy, rng, uvrots)
@@ -311,8 +330,8 @@ def test__add_lowvariance_subspace_components():
     px, py = 4, 5
     qx, qy = 4, 3
     m = 2
-    U = np.eye(px)
-    V = np.eye(py)
+    U = _EYE[:px, :px]
+    V = _EYE[:py, :py]
     U_dominant = U[:, :m]
     V_dominant = V[:, :m]
     rng = check_random_state(0)
@@ -331,8 +350,8 @@ def test__add_lowvariance_subspace_component_1dim():
     px, py = 2, 3
     qx, qy = 2, 2
     m = 1
-    U = np.eye(px)
-    V = np.eye(py)
+    U = _EYE[:px, :px]
+    V = _EYE[:py, :py]
     U_dominant = U[:, :m]
     V_dominant = V[:, :m]
     rng = check_random_state(0)
@@ -346,14 +365,14 @@ def test__add_lowvariance_subspace_component_1dim():
     V_ = _add_lowvariance_subspace_component_1dim(V, V_dominant, m, min_weight, qy, rng)
     assert V_.shape == V_dominant.shape
     assert not np.allclose(V_, V_dominant)
-    assert np.allclose(np.linalg.norm(V_, axis=0), 1)
+    assert _is_unit_norm(V_)
 
     ### m = 2
     px, py = 2, 3
     qx, qy = 2, 2
     m = 2
-    U = np.eye(px)
-    V = np.eye(py)
+    U = _EYE[:px, :px]
+    V = _EYE[:py, :py]
     U_dominant = U[:, :m]
     V_dominant = V[:, :m]
     rng = check_random_state(0)
@@ -367,7 +386,7 @@ def test__add_lowvariance_subspace_component_1dim():
     V_ = _add_lowvariance_subspace_component_1dim(V, V_dominant, m, min_weight, qy, rng)
     assert V_.shape == V_dominant.shape
     assert not np.allclose(V_, V_dominant)
-    assert np.allclose(np.linalg.norm(V_, axis=0), 1)
+    assert _is_unit_norm(V_)
 
 
 def test__variance_explained_by_latent_modes():
@@ -378,10 +397,10 @@ def test__Sigmaxy_negative_min_eval():
     m = 1
     global_true_corrs = np.array([1./2,])
     px, py = 2, 3
-    global_Sigmaxx = np.eye(px)
-    global_Sigmayy = np.eye(py)
-    U = np.eye(px)
-    V = np.eye(py)
+    global_Sigmaxx = _EYE[:px, :px]
+    global_Sigmayy = _EYE[:py, :py]
+    U = _EYE[:px, :px]
+    V = _EYE[:py, :py]
 
     qx, qy = px, py
     urot = np.ones(px)/np.sqrt(qx)
@@ -423,12 +442,23 @@ def test__Sigmaxy_negative_min_eval():
 
 
 
+# random orthonormal weight vectors for test_assemble_Sigmaxy_pls, drawn once
+# from a local generator so that importing this module leaves the global
+# numpy random state untouched
+_pls_rng = np.random.default_rng(0)
+_PLS_U = qr(_pls_rng.standard_normal(size=(2, 2)), mode='economic',
+            check_finite=False)[0]
+_PLS_V = qr(_pls_rng.standard_normal(size=(3, 3)), mode='economic',
+            check_finite=False)[0][:, :2]
+del _pls_rng
+
+
 def test_assemble_Sigmaxy_pls():
     px, py = 2, 3
-    Sigmaxx = np.eye(px)
-    Sigmayy = np.eye(py)
-    U_ = np.eye(px)
-    V_ = np.eye(py)
+    Sigmaxx = _EYE[:px, :px]
+    Sigmayy = _EYE[:py, :py]
+    U_ = _EYE[:px, :px]
+    V_ = _EYE[:py, :py]
     true_corrs = np.array([1./4, 1./2,])
     m = 2
 
@@ -442,9 +472,8 @@ def test_assemble_Sigmaxy_pls():
     assert_array_almost_equal(V_out, V_[:, order])
     assert min_eval > 0
 
-    np.random.seed(0)
-    U_ = np.linalg.qr(np.random.normal(size=(px, px)))[0]
-    V_ = np.linalg.qr(np.random.normal(size=(py, py)))[0][:, :px]
+    U_ = _PLS_U
+    V_ = _PLS_V
 
     Sigmaxy, Sigmaxy_svals, U_out, V_out, min_eval, true_corrs_out = _assemble_Sigmaxy_pls(Sigmaxx, Sigmayy, U_, V_, m, true_corrs)
     assert Sigmaxy.shape == (px, py)
@@ -459,10 +488,10 @@ def test_assemble_Sigmaxy_pls():
 
 def test__assemble_Sigmaxy_cca():
     px, py = 2, 3
-    Sigmaxx = np.eye(px)
-    Sigmayy = np.eye(py)
-    U_ = np.eye(px)
-    V_ = np.eye(py)[:, :2]
+    Sigmaxx = _EYE[:px, :px]
+    Sigmayy = _EYE[:py, :py]
+    U_ = _EYE[:px, :px]
+    V_ = _EYE[:py, :2]
     true_corrs = np.array([1./4, 1./2,])
     m = 2
     Sigmaxy, Sigmaxy_svals, U_out, V_out, min_eval, true_corrs_out = _assemble_Sigmaxy_cca(Sigmaxx, Sigmayy, U_, V_, m, true_corrs)
@@ -491,18 +520,18 @@ def test__assemble_Sigmaxy_cca():
 
 
 def test_calc_schur_complement():
-    A = np.eye(3)
+    A = _EYE[:3, :3]
     B = np.zeros((3, 2))
     B[0, 0] = B[1, 1] = 1
     C = B.T
-    D = np.eye(2)
+    D = _EYE[:2, :2]
     M = np.vstack([
         np.hstack([A, B]),
         np.hstack([C, D])
     ])
     sc1 = calc_schur_complement(A, B, C, D, kind='A')
     sc2 = calc_schur_complement(M, A.shape[1], kind='A')
-    sc_true = A - B.dot(np.linalg.inv(D)).dot(C)
+    sc_true = A - B @ solve(D, C, assume_a='pos', check_finite=False)
     assert_allclose(sc1, sc2)
     assert_allclose(sc1, sc_true)
     assert_raises(ValueError, calc_schur_complement, A, 1, kind='WRONG_KIND')
@@ -519,23 +548,24 @@ def test_generate_data():
     assert Y.shape[1] == py
 
 
-def _test_generated_data_consistency_with_model(model):
+@pytest.mark.parametrize('model,px,r_between,ax', [
+    pytest.param(model, px, r_between, ax,
+                 id=f'{model}-px{px}-r{r_between}-ax{ax}')
+    for model, px, r_between, ax in itertools.product(
+        ['cca', 'pls'], [2, 4, 32], [.9, .7, .5, .3, .2], [0, -.5, -1])
+])
+def test_generated_data_consistency_with_model(model, px, r_between, ax):
+    py = px + 2
+    gm = GEMMR(model, px=px, py=py, r_between=r_between, ax=ax, ay=ax,
+               random_state=0)
     estr = dict(cca=SVDCCA(), pls=SVDPLS())[model]
-    for px in [2, 4, 32]:
-        py = px + 2
-        for r_between in [.9, .7, .5, .3, .2]:
-            for ax in [0, -.5, -1]:
-                gm = GEMMR(model, px=px, py=py, r_between=r_between,
-                           ax=ax, ay=ax, random_state=0)
-                n_per_ftr = 512
-                for random_state in range(2):
-                    X, Y = gm.generate_data(n=(px + py) * n_per_ftr,
-                                            random_state=random_state)
-                    estr.fit(X, Y)
-                    assert_allclose(estr.corrs_[0], r_between,
-                                    rtol=1e-2, atol=0.05)
-
-
-def test_generated_data_consistency_with_model():
-    for model in ['cca', 'pls']:
-        _test_generated_data_consistency_with_model(model)
+    n_per_ftr = 512
+    # each random_state gets its own call rather than splitting a single
+    # larger draw: factorizing Sigma_ is negligible next to sampling, and
+    # some PLS cases with ax=-1 sit close to the tolerance, so the datasets
+    # tested are kept as they are
+    for random_state in range(2):
+        X, Y = gm.generate_data(n=(px + py) * n_per_ftr,
+                                random_state=random_state)
+        estr.fit(X, Y)
+        assert_allclose(estr.corrs_[0], r_between, rtol=1e-2, atol=0.05)